@@ -0,0 +1,99 @@
+"""
+Latency from the scheduler tick to the result leaving the monitor.
+Runs a local HTTP server answering right away, so that what is measured
+is the time requests and results spend in queues and not on the network.
+
+    PYTHONPATH=src python benchmarks/bench_latency.py [count] [seconds]
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+from webmon.monitor import monitor
+from webmon.pipeline import Pipeline
+from webmon.scheduler import schedule
+
+
+def serve(ready: list) -> None:
+    async def hello(request):
+        return web.Response(text="hello")
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/", hello)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ready.append(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+def stamp(source, sink) -> None:
+    """Remember when the scheduler fired the requests."""
+    while batch := source.get():
+        now = time.monotonic()
+        for x in batch:
+            x["ticked"] = now
+        sink.put(batch)
+
+
+class Record:
+    def __init__(self):
+        self.latency: list[float] = []
+        self.overhead: list[float] = []
+
+    def __call__(self, source, sink) -> None:
+        while batch := source.get():
+            now = time.monotonic()
+            for x in batch:
+                latency = (now - x["ticked"]) * 1000
+                self.latency.append(latency)
+                self.overhead.append(latency - x["response_time_ms"])
+
+
+def percentiles(name: str, values: list[float]) -> None:
+    values = sorted(values)
+    p = [values[int(len(values) * x / 100)] for x in [50, 90, 99]]
+    print(
+        f"{name:<25} p50 {p[0]:>7.1f} ms, p90 {p[1]:>7.1f} ms, "
+        f"p99 {p[2]:>7.1f} ms, max {values[-1]:>7.1f} ms"
+    )
+
+
+def main(count: int, seconds: float) -> None:
+    logging.disable(logging.WARNING)
+    ready: list[int] = []
+    threading.Thread(target=serve, args=[ready], daemon=True).start()
+    while not ready:
+        time.sleep(0.01)
+
+    config = [
+        {"url": f"http://127.0.0.1:{ready[0]}/?n={i}", "schedule": 1}
+        for i in range(0, count)
+    ]
+    record = Record()
+    pipeline = Pipeline.build(schedule, stamp, monitor, record)
+    pipeline.put(config)
+    time.sleep(seconds)
+    pipeline.put(None).wait()
+
+    print(
+        f"{count} URLs every second for {seconds} seconds, {len(record.latency)} results"
+    )
+    percentiles("tick to result", record.latency)
+    percentiles("minus response time", record.overhead)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 10,
+    )
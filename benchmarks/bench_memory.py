@@ -0,0 +1,95 @@
+"""
+Memory it takes to load a config and keep its URLs in the scheduler.
+Compares the original way (whole file through json.loads, a dict per URL)
+to the streaming loader and the compact timeline entries. The timeline numbers
+include the phase slots and the timing wheel the original did not have.
+
+    PYTHONPATH=src python benchmarks/bench_memory.py [count]
+"""
+
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from webmon import util
+from webmon.loader import iter_config, load_config
+from webmon.scheduler import Timeline, reload_config, validate_config
+
+
+def write_config(path: str, count: int, lines: bool) -> None:
+    with open(path, "w") as f:
+        if not lines:
+            f.write("[\n")
+        for i in range(0, count):
+            config = {"url": f"https://acme.com/{i}", "schedule": 1 + i % 300}
+            if i % 3 == 0:
+                config["regex"] = "Acme"
+            separator = "" if lines or i == count - 1 else ","
+            f.write(f"{json.dumps(config)}{separator}\n")
+        if not lines:
+            f.write("]\n")
+
+
+def original(path: str) -> dict:
+    """Roughly what the scheduler did before: json.loads and a dict per URL."""
+    with open(path, "r") as f:
+        config = json.loads(f.read())
+
+    now = util.now()
+    return {
+        x["url"]: {**validate_config(x), "ts": now}
+        for x in config
+        if validate_config(x)
+    }
+
+
+def loaded(path: str) -> Timeline:
+    """What the app does: load the list of validated configs, then schedule."""
+    timeline = Timeline()
+    reload_config(load_config(path) or [], timeline)
+    return timeline
+
+
+def streaming(path: str) -> Timeline:
+    """Straight from the file into the timeline, one entry at a time."""
+    timeline = Timeline()
+    with open(path, "r") as f:
+        reload_config(iter_config(f), timeline)
+    return timeline
+
+
+def measure(name: str, load, count: int) -> None:
+    gc.collect()
+    tracemalloc.start()
+    started = time.monotonic()
+    result = load()
+    spent = time.monotonic() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:<30} {spent:>6.1f} sec, peak {peak / 2**20:>8.1f} MiB, "
+        f"kept {current / 2**20:>8.1f} MiB, {current / count:>6.0f} bytes/URL"
+    )
+    del result
+
+
+def main(count: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        for lines in [False, True]:
+            path = os.path.join(directory, "config.jsonl" if lines else "config.json")
+            write_config(path, count, lines)
+            print(f"{count} URLs from {os.path.basename(path)}")
+
+            if not lines:  # the original loader did not support JSON Lines
+                measure("json.loads + dicts", lambda: original(path), count)
+            measure("load_config + timeline", lambda: loaded(path), count)
+            measure("streaming into timeline", lambda: streaming(path), count)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
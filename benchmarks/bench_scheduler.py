@@ -0,0 +1,89 @@
+"""
+Compare the cost of a scheduler tick: full config scan against the timeline heap.
+Configs from data/ are scaled up by appending a query string to every URL.
+
+    PYTHONPATH=src python benchmarks/bench_scheduler.py [count]
+"""
+
+import json
+import sys
+import time
+
+from typing import Optional
+
+from webmon import util
+from webmon.scheduler import Timeline, reload_config, tick
+
+
+class NullSink:
+    def __init__(self):
+        self.count = 0
+
+    def put(self, batch: list) -> None:
+        self.count += len(batch)
+
+    def qsize(self) -> int:
+        return 0
+
+    def credit(self) -> Optional[int]:
+        return None
+
+
+def scale_config(path: str, count: int) -> list[dict]:
+    with open(path, "r") as f:
+        base = json.loads(f.read())
+
+    return [
+        {**base[i % len(base)], "url": f'{base[i % len(base)]["url"]}/?n={i}'}
+        for i in range(0, count)
+    ]
+
+
+def scan_tick(config: dict, sink) -> None:
+    """The original O(n) tick, kept here for the reference."""
+    now = util.now()
+    batch = []
+    for k, v in config.items():
+        if now > v["ts"]:
+            v["ts"] += v["schedule"]
+            batch.append(v)
+
+    if batch:
+        sink.put(batch)
+
+
+def measure(name: str, tick_once, seconds: float = 3) -> None:
+    sink = NullSink()
+    ticks = 0
+    spent = 0.0
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        before = time.perf_counter()
+        tick_once(sink)
+        spent += time.perf_counter() - before
+        ticks += 1
+        time.sleep(0.05)
+
+    print(
+        f"{name:<30} {ticks:>5} ticks, {spent / ticks * 1000:>8.3f} ms/tick, "
+        f"{sink.count / seconds:>10.0f} requests/sec"
+    )
+
+
+def main(count: int) -> None:
+    for path in ["data/config_1000_1.json", "data/config_1000_5.json"]:
+        config = scale_config(path, count)
+        print(f"{path} scaled to {count} URLs")
+
+        timeline = Timeline()
+        reload_config(config, timeline)
+        scan = {v.url: v.request() for v in timeline.entries.values()}
+        measure("full scan", lambda sink: scan_tick(scan, sink))
+
+        timeline = Timeline()
+        reload_config(config, timeline)
+        measure("timeline", lambda sink: tick(None, timeline, sink))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import socket
+import sqlite3
+import time
+
+import asyncpg  # type: ignore
+
+from queue import Empty
+from typing import Any, Optional
+
+from . import constants
+from .database import ConnectionDetails
+from .scheduler import ConfigDiff
+from .shards import hash64
+
+CREATE_LEASES = """CREATE TABLE IF NOT EXISTS webmon_leases (
+                       part INT PRIMARY KEY,
+                       owner VARCHAR(255),
+                       expires DOUBLE PRECISION)"""
+
+CREATE_NODES = """CREATE TABLE IF NOT EXISTS webmon_nodes (
+                       owner VARCHAR(255) PRIMARY KEY,
+                       expires DOUBLE PRECISION)"""
+
+
+def partition_of(url: str, partitions: int) -> int:
+    return hash64(url) % partitions
+
+
+class LeaseStore:
+    """
+    Time bounded leases on URL partitions kept in a coordination table.
+    Every instance sends a heartbeat, renews its leases, claims free or expired
+    partitions up to its fair share and gives away the ones above it.
+    Backends only need to run SQL, the statements are the same for SQLite and Postgres.
+    """
+
+    def execute(self, sql: str, *args: Any) -> int:
+        """Run the statement and return the number of affected rows."""
+        raise NotImplementedError
+
+    def fetch(self, sql: str, *args: Any) -> list[tuple]:
+        raise NotImplementedError
+
+    def now(self) -> float:
+        """Current time according to the coordinator, not to the local clock."""
+        raise NotImplementedError
+
+    def setup(self, partitions: int) -> None:
+        self.execute(CREATE_LEASES)
+        self.execute(CREATE_NODES)
+        for partition in range(0, partitions):
+            self.execute(
+                "INSERT INTO webmon_leases(part, owner, expires) VALUES(?, NULL, 0) "
+                "ON CONFLICT DO NOTHING",
+                partition,
+            )
+
+    def acquire(self, owner: str, now: float, ttl: float) -> set[int]:
+        """One round of the protocol, returns the partitions we own for the next ttl seconds."""
+        expires = now + ttl
+        self.execute(
+            "INSERT INTO webmon_nodes(owner, expires) VALUES(?, ?) "
+            "ON CONFLICT(owner) DO UPDATE SET expires = excluded.expires",
+            owner,
+            expires,
+        )
+        self.execute(
+            "UPDATE webmon_leases SET expires = ? WHERE owner = ?", expires, owner
+        )
+
+        partitions = self.fetch("SELECT part, owner, expires FROM webmon_leases")
+        nodes = self.fetch("SELECT count(*) FROM webmon_nodes WHERE expires > ?", now)
+        target = math.ceil(len(partitions) / max(1, nodes[0][0]))
+
+        owned = [x[0] for x in partitions if x[1] == owner]
+        free = [x[0] for x in partitions if x[1] != owner and (not x[1] or x[2] < now)]
+        random.shuffle(free)
+
+        while len(owned) < target and free:
+            partition = free.pop()
+            if self.execute(
+                "UPDATE webmon_leases SET owner = ?, expires = ? "
+                "WHERE part = ? AND (owner IS NULL OR expires < ?)",
+                owner,
+                expires,
+                partition,
+                now,
+            ):
+                owned.append(partition)
+
+        while len(owned) > target:
+            self.execute(
+                "UPDATE webmon_leases SET owner = NULL, expires = 0 "
+                "WHERE part = ? AND owner = ?",
+                owned.pop(),
+                owner,
+            )
+
+        return set(owned)
+
+    def release(self, owner: str) -> None:
+        """Give away everything we own, the others do not have to wait for expiration."""
+        self.execute(
+            "UPDATE webmon_leases SET owner = NULL, expires = 0 WHERE owner = ?", owner
+        )
+        self.execute("DELETE FROM webmon_nodes WHERE owner = ?", owner)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteLeases(LeaseStore):
+    """Local SQLite stand-in for the coordination table, good for a single box."""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, timeout=10
+        )
+
+    def execute(self, sql: str, *args: Any) -> int:
+        return self.connection.execute(sql, args).rowcount
+
+    def fetch(self, sql: str, *args: Any) -> list[tuple]:
+        return self.connection.execute(sql, args).fetchall()
+
+    def now(self) -> float:
+        return time.time()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def numbered_placeholders(sql: str) -> str:
+    """Postgres wants $1, $2 instead of question marks."""
+    parts = sql.split("?")
+    return "".join(f"{x}${i + 1}" for i, x in enumerate(parts[:-1])) + parts[-1]
+
+
+class PostgresLeases(LeaseStore):
+    """Coordination table in the same Postgres database we put the measurements to."""
+
+    def __init__(self, details: ConnectionDetails):
+        # the cluster node is synchronous, it gets an event loop of its own
+        self.loop = asyncio.new_event_loop()
+        self.connection = self.loop.run_until_complete(
+            asyncpg.connect(**details._asdict())
+        )
+
+    def execute(self, sql: str, *args: Any) -> int:
+        status = self.loop.run_until_complete(
+            self.connection.execute(numbered_placeholders(sql), *args)
+        )
+        # status looks like "UPDATE 1"
+        count = status.split()[-1]
+        return int(count) if count.isdigit() else 0
+
+    def fetch(self, sql: str, *args: Any) -> list[tuple]:
+        rows = self.loop.run_until_complete(
+            self.connection.fetch(numbered_placeholders(sql), *args)
+        )
+        return [tuple(x) for x in rows]
+
+    def now(self) -> float:
+        return float(self.fetch("SELECT extract(epoch from clock_timestamp())")[0][0])
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self.connection.close())
+        self.loop.close()
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Cluster:
+    """
+    Pipeline handler placed in front of the scheduler when running a number of
+    instances against the same coordination table. Remembers the whole config
+    but passes through only the URLs from the partitions we hold leases on.
+    Gained and lost partitions become config diffs for the scheduler.
+    """
+
+    def __init__(
+        self,
+        store: LeaseStore,
+        node_id: Optional[str] = None,
+        partitions: int = constants.CLUSTER_PARTITIONS,
+        ttl: float = constants.LEASE_TTL_SEC,
+    ):
+        self.store = store
+        self.node_id = node_id or default_node_id()
+        self.partitions = partitions
+        self.ttl = ttl
+        self.members: dict[int, dict[str, dict]] = {x: {} for x in range(0, partitions)}
+        self.owned: set[int] = set()
+        self.valid_until = 0.0
+
+    def renew(self) -> Optional[ConfigDiff]:
+        """Run a round of the lease protocol, return the changes in what we own."""
+        try:
+            now = self.store.now()
+            owned = self.store.acquire(self.node_id, now, self.ttl)
+            self.valid_until = time.monotonic() + self.ttl
+        except Exception as e:
+            logging.error(f"Unable to renew leases: {e}")
+            # somebody else will take over once the leases expire, stop before that
+            owned = self.owned if time.monotonic() < self.valid_until else set()
+
+        gained, lost = owned - self.owned, self.owned - owned
+        self.owned = owned
+
+        upsert = [x for p in gained for x in self.members[p].values()]
+        remove = [x for p in lost for x in self.members[p].keys()]
+        return ConfigDiff(upsert, remove) if upsert or remove else None
+
+    def accept(self, message: Any) -> Optional[Any]:
+        """Remember config changes, return the part that we own."""
+        if isinstance(message, list):
+            message = ConfigDiff(upsert=message)
+        elif not isinstance(message, ConfigDiff):
+            return None
+
+        upsert, remove = [], []
+        for x in message.upsert:
+            if isinstance(x, dict) and isinstance(x.get("url", None), str):
+                partition = partition_of(x["url"], self.partitions)
+                self.members[partition][x["url"]] = x
+                if partition in self.owned:
+                    upsert.append(x)
+
+        for url in message.remove:
+            partition = partition_of(url, self.partitions)
+            self.members[partition].pop(url, None)
+            if partition in self.owned:
+                remove.append(url)
+
+        if not upsert and not remove:
+            return None
+        return ConfigDiff(upsert, remove) if remove else upsert
+
+    def __call__(self, source, sink) -> None:
+        self.store.setup(self.partitions)
+        next_renew = 0.0
+        try:
+            while True:
+                if time.monotonic() >= next_renew:
+                    if diff := self.renew():
+                        sink.put(diff)
+                    next_renew = time.monotonic() + self.ttl / 3
+
+                try:
+                    message = source.get(timeout=max(next_renew - time.monotonic(), 0))
+                except Empty:
+                    continue
+
+                if not message:
+                    break
+
+                if owned := self.accept(message):
+                    sink.put(owned)
+        finally:
+            self.store.release(self.node_id)
+            self.store.close()
@@ -1,8 +1,20 @@
 MIN_POLL_PERIOD_SEC: int = 1
 MAX_POLL_PERIOD_SEC: int = 300
 MAX_CONNECTIONS: int = 100
+MAX_CONNECTIONS_PER_HOST: int = 20
+MIN_HOST_SPACING_SEC: float = 0.0
 MAX_CONTENT_LENGTH: int = 10 * 1024 * 1024
 PG_POOL_SIZE: int = 10
 MAX_DB_RECORDS: int = 100000
 MAX_CONNECTION_TIMEOUT: int = 30
 SCHEDULE_PERIOD = 0.05
+MAX_REQUESTS_PER_SEC: float = 10000
+SHAPER_SLOT_SEC: float = 0.01
+TIMELINE_RESOLUTION_SEC: float = 0.001
+HASH_RING_REPLICAS: int = 100
+CLUSTER_PARTITIONS: int = 64
+LEASE_TTL_SEC: float = 15
+CONFIG_POLL_SEC: float = 1
+CONFIG_CHUNK_SIZE: int = 64 * 1024
+KEEP_ALIVE_TIMEOUT_SEC: float = 15
+KEEP_ALIVE_DRAIN_BYTES: int = 64 * 1024
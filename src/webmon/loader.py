@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import re
+
+from typing import IO, Any, Iterator, Optional
+
+from . import constants
+from .scheduler import validate_config
+
+WHITESPACE = re.compile(r"\s*")
+
+
+def iter_json_array(f: IO[str]) -> Iterator[Any]:
+    """
+    Elements of the top level JSON array, decoded one at a time.
+    Only the current element and one chunk of the file are kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    started, expect_value = False, True
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()  # type: ignore
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = f.read(constants.CONFIG_CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        char = buffer[pos]
+        if not started:
+            if char != "[":
+                raise ValueError("JSON array expected")
+            started, pos = True, pos + 1
+        elif char == "]":
+            return
+        elif char == ",":
+            if expect_value:
+                raise ValueError(f"Unexpected comma in JSON array")
+            expect_value, pos = True, pos + 1
+        elif not expect_value:
+            raise ValueError(f"Comma expected in JSON array")
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = len(buffer)
+
+            after = WHITESPACE.match(buffer, end).end()  # type: ignore
+            if not eof and (after == len(buffer) or buffer[after] not in ",]"):
+                # the element might continue in the next chunk, like 3.5 split after 3.
+                chunk = f.read(constants.CONFIG_CHUNK_SIZE)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+
+            yield value
+            pos, expect_value = end, False
+
+
+def iter_json_lines(f: IO[str]) -> Iterator[Any]:
+    """Values from JSON Lines, lines that fail to decode are skipped."""
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning(f"Wrong JSON on line {number}: {line[:100]}")
+
+
+def iter_config(f: IO[str]) -> Iterator[dict]:
+    """
+    Validated URL configs from either JSON array or JSON Lines file.
+    The format is told by the first character, entries are read one at a time.
+    """
+    while (char := f.read(1)).isspace():
+        pass
+    f.seek(0)
+
+    values = iter_json_array(f) if char == "[" else iter_json_lines(f)
+    for x in values:
+        if cleaned := validate_config(x):
+            yield cleaned
+
+
+def load_config(json_or_file_path: str) -> Optional[list[dict]]:
+    """Load config from JSON or file."""
+    try:
+        if os.path.isfile(json_or_file_path):
+            with open(json_or_file_path, "r") as f:
+                return list(iter_config(f))
+
+        config = json.loads(json_or_file_path)
+        return [x for x in map(validate_config, config) if x]
+    except Exception as e:
+        logging.error(f"Unable to load config: {e}")
+        return None
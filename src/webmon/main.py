@@ -1,15 +1,20 @@
-from webmon.monitor import monitor
+from webmon.monitor import monitor, MonitorOptions
 from webmon.scheduler import schedule
 from webmon.validator import validate
 from webmon.pipeline import Pipeline
 from webmon.database import Database, ConnectionDetails
+from webmon.shards import Shards
+from webmon.cluster import Cluster, LeaseStore, SqliteLeases, PostgresLeases
+from webmon.watcher import ConfigWatcher
+from webmon.loader import load_config
 
-from typing import Optional, Any
+from typing import Optional, Any, Callable
 
 import argparse
-import json
+import os
 import signal
 import sys
+import threading
 import time
 
 test_config = [
@@ -38,10 +43,23 @@ def print_to_console(source, sink) -> None:
 
 
 def run_pipeline(
-    url_config: list[dict], db_config: Optional[ConnectionDetails]
+    url_config: list[dict],
+    db_config: Optional[ConnectionDetails],
+    shards: int = 1,
+    leases: Optional[LeaseStore] = None,
+    config_path: Optional[str] = None,
+    options: MonitorOptions = MonitorOptions(),
 ) -> None:
     """Build and run the pipeline. This is crux of the matter."""
-    pipeline = Pipeline.build(schedule, monitor, validate, print_to_console)
+
+    def monitor_with_options(source, sink) -> None:
+        monitor(source, sink, options)
+
+    nodes: list[Callable] = [Cluster(leases)] if leases else []
+    nodes += (
+        [Shards(shards, options)] if shards > 1 else [schedule, monitor_with_options]
+    )
+    pipeline = Pipeline.build(*nodes, validate, print_to_console)
 
     if db_config:
         pipeline.then(Database(db_config))
@@ -53,21 +71,24 @@ def run_pipeline(
     pipeline.then(consume)
 
     pipeline.put(url_config)
+
+    if config_path and os.path.isfile(config_path):
+        watcher = ConfigWatcher(config_path, load_config, pipeline.put, url_config)
+        watcher.start()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda signum, frame: watcher.trigger())
+
     pipeline.wait()
 
 
-def load_config(json_or_file_path: str) -> Optional[list[dict]]:
-    """Load config from JSON or file."""
-    try:
-        return json.loads(json_or_file_path)
-    except Exception as e:
-        pass
+def make_lease_store(
+    cluster: Optional[str], db_config: Optional[ConnectionDetails]
+) -> Optional[LeaseStore]:
+    """Coordination table for the cluster mode, either in Postgres or in SQLite file."""
+    if cluster == "postgres":
+        return PostgresLeases(db_config) if db_config else None
 
-    try:
-        with open(json_or_file_path, "r") as f:
-            return json.loads(f.read())
-    except Exception as e:
-        return None
+    return SqliteLeases(cluster) if cluster else None
 
 
 def configuration_from_args(
@@ -130,6 +151,26 @@ def parse_args(args_list: Optional[list[str]] = None):
         "--ssl", action="store", default="require", type=str, help="posgres SSL mode"
     )
 
+    parser.add_argument(
+        "--shards",
+        action="store",
+        type=int,
+        default=1,
+        help="number of processes to run schedulers and monitors in",
+    )
+
+    parser.add_argument(
+        "--cluster",
+        action="store",
+        help="share URLs with other instances, coordinate through 'postgres' or SQLite file path",
+    )
+
+    parser.add_argument(
+        "--keep-alive",
+        action="store_true",
+        help="reuse connections to the sites instead of connecting for every request",
+    )
+
     args = parser.parse_args(args_list)
     return args
 
@@ -140,5 +181,16 @@ def main() -> int:
     if not conf:
         return 1
 
-    run_pipeline(*conf)
+    leases = make_lease_store(args.cluster, conf[1])
+    if args.cluster and not leases:
+        print("ERROR: --cluster=postgres requires the database configuration")
+        return 1
+
+    run_pipeline(
+        *conf,
+        shards=args.shards,
+        leases=leases,
+        config_path=None if args.test else args.config,
+        options=MonitorOptions(keep_alive=args.keep_alive),
+    )
     return 0
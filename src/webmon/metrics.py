@@ -0,0 +1,68 @@
+import threading
+
+from typing import Union
+
+
+class Summary:
+    """Running count, sum and maximum of observed values."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, values: tuple[float, ...]) -> None:
+        if values:
+            self.max = max(self.max, *values) if self.count else max(values)
+            self.count += len(values)
+            self.total += sum(values)
+
+
+class Metrics:
+    """
+    Thread safe registry of counters, gauges and value summaries.
+    Every pipeline node in the process writes into the same registry.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: dict[str, float] = {}
+        self.summaries: dict[str, Summary] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add to counter."""
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        """Set gauge."""
+        with self.lock:
+            self.values[name] = value
+
+    def observe(self, name: str, *values: float) -> None:
+        """Add values to summary, like latencies or queue sizes."""
+        with self.lock:
+            self.summaries.setdefault(name, Summary()).add(values)
+
+    def get(self, name: str) -> float:
+        with self.lock:
+            return self.values.get(name, 0)
+
+    def snapshot(self) -> dict[str, Union[int, float]]:
+        """Flat copy of every metric, summaries are split into count, avg and max."""
+        with self.lock:
+            result: dict[str, Union[int, float]] = {**self.values}
+            for k, v in self.summaries.items():
+                result[f"{k}.count"] = v.count
+                result[f"{k}.avg"] = v.total / v.count if v.count else 0.0
+                result[f"{k}.max"] = v.max
+
+        return result
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values = {}
+            self.summaries = {}
+
+
+registry = Metrics()
@@ -1,15 +1,27 @@
 import aiohttp
 import asyncio
+import ssl
 
 from . import util
 from . import constants
+from .metrics import registry
+from .pipeline import bridge_to_loop
 
 import traceback
 import time
 import logging
 import resource
 
-from typing import Optional, Generator, Callable
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from types import SimpleNamespace
+from typing import Optional, AsyncIterator, NamedTuple
+
+
+class MonitorOptions(NamedTuple):
+    """How the monitor talks to the sites, the defaults are the most conservative."""
+
+    keep_alive: bool = False
 
 
 def set_max_file_limit() -> None:
@@ -29,6 +41,16 @@ async def read_from_stream(stream: aiohttp.StreamReader, num_bytes: int) -> byte
     return data
 
 
+async def drain(stream: aiohttp.StreamReader, num_bytes: int) -> None:
+    """Read and throw away the rest of the stream unless it is longer than num_bytes."""
+    while num_bytes > 0 and (chunk := await stream.read(num_bytes)):
+        num_bytes -= len(chunk)
+
+
+def keeps_connections(session: aiohttp.ClientSession) -> bool:
+    return session.connector is not None and not session.connector.force_close
+
+
 async def read_chunked_response(
     response: aiohttp.ClientResponse, num_bytes: int
 ) -> str:
@@ -38,13 +60,23 @@ async def read_chunked_response(
     return str(data, response.get_encoding())
 
 
-async def fetch_with_session(session: aiohttp.ClientSession, request: dict) -> dict:
-    """Issue a GET request to the URL specified in the request dict."""
-    result = {**request}
+async def fetch_with_session(
+    session: aiohttp.ClientSession,
+    request: dict,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> dict:
+    """
+    Issue a GET request to the URL specified in the request dict.
+    The request is updated in place and becomes the result, no copies per fetch.
+    The timeout overrides the one of the session.
+    """
+    result = request
     started = time.time()
     try:
         result["ts"] = util.now()
-        async with session.get(request["url"], allow_redirects=False) as response:
+        async with session.get(
+            request["url"], allow_redirects=False, timeout=timeout or session.timeout
+        ) as response:
             result.update(
                 {
                     "status": "completed",
@@ -67,6 +99,10 @@ async def fetch_with_session(session: aiohttp.ClientSession, request: dict) -> d
                         response, constants.MAX_CONTENT_LENGTH
                     )
 
+            if not "body" in result and keeps_connections(session):
+                # unread response closes the connection, give it back to the pool instead
+                await drain(response.content, constants.KEEP_ALIVE_DRAIN_BYTES)
+
     except aiohttp.ClientError as e:
         result.update({"status": type(e).__name__})
     except asyncio.exceptions.TimeoutError:
@@ -88,6 +124,74 @@ async def fetch_url(request: dict) -> dict:
         return await fetch_with_session(session, request)
 
 
+class HostState:
+    """Concurrency and spacing of the requests to a single host."""
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.next_start = 0.0
+
+
+class HostLimiter:
+    """
+    Per host politeness: caps the number of concurrent requests to the same host
+    and keeps the minimum time between their starts. Requests to one host wait in line
+    (first come first served) without holding up requests to other hosts.
+    """
+
+    def __init__(self):
+        self.limit = constants.MAX_CONNECTIONS_PER_HOST
+        self.spacing = constants.MIN_HOST_SPACING_SEC
+        self.hosts: dict[str, HostState] = {}
+
+    @asynccontextmanager
+    async def __call__(self, url: str) -> AsyncIterator[None]:
+        """Wait for our turn to send a request to the host."""
+        host = urlsplit(str(url)).hostname or ""
+        if not host in self.hosts:
+            self.hosts[host] = HostState(self.limit)
+
+        state = self.hosts[host]
+        async with state.semaphore:
+            now = asyncio.get_running_loop().time()
+            delay = state.next_start - now
+            state.next_start = max(now, state.next_start) + self.spacing
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            yield
+
+
+async def fetch_politely(limiter: HostLimiter, pool, request: dict) -> dict:
+    """Issue a GET request once the host is ready to take it."""
+    async with limiter(request["url"]):
+        return await fetch_with_session(pool(request), request, pool.timeout(request))
+
+
+def trace_connections() -> aiohttp.TraceConfig:
+    """
+    Report the cost of new connections (TCP and TLS handshakes) apart from the
+    response times, reused connections are only counted.
+    """
+
+    async def on_create_start(session, context: SimpleNamespace, params) -> None:
+        context.connect_started = time.monotonic()
+
+    async def on_create_end(session, context: SimpleNamespace, params) -> None:
+        elapsed_ms = (time.monotonic() - context.connect_started) * 1000
+        registry.observe("monitor.connect_ms", elapsed_ms)
+        registry.increment("monitor.connections_created")
+
+    async def on_reuse(session, context: SimpleNamespace, params) -> None:
+        registry.increment("monitor.connections_reused")
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_start.append(on_create_start)
+    trace.on_connection_create_end.append(on_create_end)
+    trace.on_connection_reuseconn.append(on_reuse)
+    return trace
+
+
 class SessionPool:
     """
     Pool of aiohttp sessions, each of them configured with a different timeout.
@@ -106,11 +210,19 @@ class SessionPool:
             connector = aiohttp.TCPConnector(
                 limit=0, force_close=True, ttl_dns_cache=300, use_dns_cache=True
             )
-            session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+            session = aiohttp.ClientSession(
+                timeout=timeout,
+                connector=connector,
+                trace_configs=[trace_connections()],
+            )
             self.sessions[schedule] = session
 
         return self.sessions[schedule]
 
+    def timeout(self, request: dict) -> Optional[aiohttp.ClientTimeout]:
+        """Sessions come with the timeout already."""
+        return None
+
     async def close(self) -> None:
         """Gracefully shutdown all sessions with underlaying TCP connections."""
         tasks = [asyncio.create_task(v.close()) for k, v in self.sessions.items()]
@@ -124,74 +236,84 @@ class SessionPool:
         await self.close()
 
 
-def read_batch(pending: int, source) -> tuple[list[dict], bool]:
-    """Read everything from queue until the queue is empty or we hit a limit."""
-    result: list[dict] = []
-    terminate = False
-    # i think we want to be smarter than this way of limiting rescurces
-    # we can just start actively dropping incoming requests if we reach our limits
-    # but also we do not want to allow some rogue site to consume all our capacity
-    while pending + len(result) < constants.MAX_CONNECTIONS and not source.empty():
-        try:
-            batch = source.get_nowait()
-        except:
-            # should not happen
-            pass
-
-        if batch is None:
-            terminate = True
-            break
-        else:
-            result += batch
-
-    return (result, terminate)
-
-
-def try_next_batch(
-    count_tasks: Callable, source
-) -> Generator[Optional[list[dict]], None, None]:
-    """Generate batches or nothing withougt blocking while no sentinel met"""
-    terminate = False
-    while not terminate:
-        batch, terminate = read_batch(count_tasks(), source)
-        yield batch
-
-
-async def run_async(source, sink) -> None:
+class KeepAlivePool(SessionPool):
     """
-    Run pipeline node asynchronously.
-    Read input messages from source queue.
-    Write output messages to sink queue.
+    Single session with persistent connections shared by all URLs.
+    The connector keeps idle connections for a while and caps them per host,
+    TLS contexts are shared, timeouts are set per request instead of per session.
     """
 
-    tasks: list[asyncio.Task] = []
-    async with SessionPool() as pool:
-        for batch in try_next_batch(lambda: len(tasks), source):
-            if batch:
-                tasks += [
-                    asyncio.create_task(fetch_with_session(pool(x), x)) for x in batch
-                ]
-
-            if tasks:
-                execute = tasks[: constants.MAX_CONNECTIONS]
-                onhold = tasks[constants.MAX_CONNECTIONS :]
+    def __init__(self):
+        super().__init__()
+        self.timeouts: dict[int, aiohttp.ClientTimeout] = {}
 
-                done, pending = await asyncio.wait(execute, timeout=0.3)
-                tasks = list(pending) + onhold
-                # print(f"done {len(done)} pending {len(pending)} {len(tasks)}")
+    def __call__(self, request: dict) -> aiohttp.ClientSession:
+        if not self.sessions:
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=constants.MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=constants.KEEP_ALIVE_TIMEOUT_SEC,
+                ssl=ssl.create_default_context(),
+                ttl_dns_cache=300,
+                use_dns_cache=True,
+            )
+            self.sessions[0] = aiohttp.ClientSession(
+                connector=connector, trace_configs=[trace_connections()]
+            )
 
-                if done:
-                    results = [x.result() for x in done]
-                    sink.put(results)
+        return self.sessions[0]
 
-            else:
-                await asyncio.sleep(0.1)
+    def timeout(self, request: dict) -> Optional[aiohttp.ClientTimeout]:
+        schedule = min(request["schedule"], constants.MAX_CONNECTION_TIMEOUT)
+        if not schedule in self.timeouts:
+            self.timeouts[schedule] = aiohttp.ClientTimeout(total=schedule)
 
-        if tasks:
-            sink.put(await asyncio.gather(*tasks))
+        return self.timeouts[schedule]
 
 
-def monitor(source, sink) -> None:
+async def run_async(source, sink, options: MonitorOptions = MonitorOptions()) -> None:
+    """
+    Run pipeline node asynchronously.
+    Requests arrive through the bridge as soon as they are put to the source,
+    every result is published as soon as its fetch is done, nothing polls.
+    Results finished within the same loop iteration go out in one batch.
+    """
+    loop = asyncio.get_running_loop()
+    inbox = bridge_to_loop(source, loop)
+    in_flight: set[asyncio.Task] = set()
+    finished: list[dict] = []
+
+    def publish() -> None:
+        if finished:
+            sink.put(finished[:])
+            finished.clear()
+
+        # let the scheduler know how much more we can take
+        source.grant(2 * constants.MAX_CONNECTIONS - len(in_flight))
+
+    def on_done(task: asyncio.Task) -> None:
+        in_flight.discard(task)
+        if not task.cancelled():
+            if not finished:
+                loop.call_soon(publish)
+            finished.append(task.result())
+
+    limiter = HostLimiter()
+    async with KeepAlivePool() if options.keep_alive else SessionPool() as pool:
+        while (batch := await inbox.get()) is not None:
+            for x in batch:
+                task = asyncio.create_task(fetch_politely(limiter, pool, x))
+                task.add_done_callback(on_done)
+                in_flight.add(task)
+
+            source.grant(2 * constants.MAX_CONNECTIONS - len(in_flight))
+
+        if in_flight:
+            await asyncio.wait(in_flight)
+        publish()
+
+
+def monitor(source, sink, options: MonitorOptions = MonitorOptions()) -> None:
     """Synchronous pipeline handler. Ment to be run in a separate thread"""
     set_max_file_limit()
-    asyncio.run(run_async(source, sink))
+    asyncio.run(run_async(source, sink, options))
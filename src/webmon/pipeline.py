@@ -1,15 +1,86 @@
-from typing import Callable
+from typing import Callable, Optional, Any
 
 from queue import SimpleQueue
 from queue import Empty
 
-from threading import Thread
+from threading import Thread, Lock
 import asyncio
 import traceback
 
 
+def message_size(message: Any) -> int:
+    """Number of items in the message, batches are lists."""
+    return len(message) if isinstance(message, list) else 0
+
+
+class Channel:
+    """
+    Queue connecting two pipeline nodes with optional credit based flow control.
+    The consumer advertises how many more items it is ready to take (the window),
+    the producer spends the credit and holds the rest back. A consumer that never
+    advertises anything does not do flow control.
+    """
+
+    def __init__(self):
+        self.queue: SimpleQueue = SimpleQueue()
+        self.lock = Lock()
+        self.window: Optional[int] = None
+        self.queued = 0
+
+    def put(self, message: Any) -> None:
+        with self.lock:
+            self.queued += message_size(message)
+        self.queue.put(message)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        message = self.queue.get(block, timeout)
+        with self.lock:
+            self.queued -= message_size(message)
+        return message
+
+    def get_nowait(self) -> Any:
+        return self.get(False)
+
+    def empty(self) -> bool:
+        return self.queue.empty()
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    def grant(self, window: int) -> None:
+        """Consumer side: advertise how many items we can take not counting the queued ones."""
+        with self.lock:
+            self.window = window
+
+    def credit(self) -> Optional[int]:
+        """Producer side: how many more items we are allowed to put, None if unlimited."""
+        with self.lock:
+            if self.window is None:
+                return None
+            return max(self.window - self.queued, 0)
+
+
+def bridge_to_loop(source, loop: asyncio.AbstractEventLoop) -> asyncio.Queue:
+    """
+    Hand messages over from the source to the event loop as soon as they arrive.
+    A thread blocks on the source and wakes the loop up with call_soon_threadsafe,
+    so the loop never polls. The thread stops after passing the sentinel on.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def pump() -> None:
+        while True:
+            message = source.get()
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+            if message is None:
+                break
+
+    Thread(target=pump, daemon=True).start()
+    return queue
+
+
 def make_queue():
-    return SimpleQueue()
+    return Channel()
 
 
 def retrieve_everything(queue) -> tuple[list, bool]:
@@ -1,41 +1,224 @@
+import sys
 import time
+import heapq
+import itertools
 import logging
-import random
 
-from typing import Optional, Generator
+from queue import Empty
+from typing import Optional, Generator, Iterable, NamedTuple, Sequence, Union
 
 from . import util
 from . import constants
+from .metrics import registry
+from .shaper import RateShaper
 
 
-def try_fetch_config(source) -> Generator[Optional[list[dict]], None, None]:
-    """Try reading input queue untile sentinel is found."""
+class ConfigDiff(NamedTuple):
+    """
+    Incremental config update, an alternative to sending the whole config.
+    Adds or overrides URLs from upsert and stops watching URLs from remove.
+    """
+
+    upsert: Sequence[dict] = ()
+    remove: Sequence[str] = ()
+
+
+ConfigUpdate = Union[list, ConfigDiff]
+
+
+def wait_for_config(
+    source, timeline: "Timeline", period: Optional[float] = None
+) -> Generator[Optional[ConfigUpdate], None, None]:
+    """
+    Block until the next URL is due or a new config arrives, whichever is sooner.
+    Yields the new config or nothing if just woke up on time, stops at sentinel.
+    The optional period limits how long we are allowed to sleep.
+    """
     while True:
-        request = None
-        if not source.empty():
-            try:
+        timeout = period
+        due = timeline.next_due()
+        if due is not None:
+            wait = max(due - util.now(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+
+        try:
+            if timeout is not None and timeout <= 0:
+                # running behind the schedule, still give other threads a chance
+                time.sleep(0)
                 request = source.get_nowait()
-                if request and not isinstance(request, list):
-                    request = None
-                if not request:
-                    break
-            except:
-                # should not happen
-                pass
+            else:
+                request = source.get(timeout=timeout)
+        except Empty:
+            request = None
+        else:
+            if not request:
+                break
+            if not isinstance(request, (list, ConfigDiff)):
+                request = None
 
         yield request
 
 
-def schedule(source, sink, period=0.05) -> None:
+class Entry:
+    """
+    Scheduled URL. There may be millions of them, hence slots instead of a dict
+    and interned strings shared with the other tables keyed by URL.
+    """
+
+    __slots__ = ("url", "schedule", "regex", "ts", "slot")
+
+    def __init__(
+        self,
+        url: str,
+        schedule: int,
+        regex: Optional[str],
+        ts: float,
+        slot: int = -1,
+    ):
+        self.url = sys.intern(url)
+        self.schedule = schedule
+        self.regex = sys.intern(regex) if regex else None
+        self.ts = ts
+        self.slot = slot  # phase slot taken from the shaper, -1 for none
+
+    @staticmethod
+    def from_config(config: dict, ts: float, slot: int) -> "Entry":
+        regex = config.get("regex", None)
+        return Entry(config["url"], config["schedule"], regex, ts, slot)
+
+    def request(self, ts: Optional[float] = None) -> dict:
+        """New request for the monitor, which takes ownership of it."""
+        request = {"url": self.url, "schedule": self.schedule}
+        if self.regex:
+            request["regex"] = self.regex
+        request["ts"] = self.ts if ts is None else ts
+        return request
+
+
+def schedule(source, sink, period: Optional[float] = None) -> None:
     """
     Pipeline handler, reads from source, processes and puts outputs to sink.
     Receives configs with URLs and schedules HTTP requests, watches over time and schedule.
+    Sleeps until the earliest URL is due, does not poll.
+    """
+    timeline = Timeline()
+
+    for request in wait_for_config(source, timeline, period):
+        tick(request, timeline, sink)
+
+
+class Timeline:
+    """
+    Timing wheel of URL configs: entries due within the same millisecond share
+    a bucket, and there is a heap of bucket keys to find the earliest one.
+    Adding and firing an entry costs O(1), there are way fewer buckets than URLs
+    since the shaper puts all URLs on a coarse grid.
+    Overridden and removed configs are not searched for in the buckets,
+    they are left there and skipped once their bucket is due.
     """
-    config: dict = {}
 
-    for request in try_fetch_config(source):
-        tick(request, config, sink)
-        time.sleep(period)
+    def __init__(self, shaper: Optional[RateShaper] = None):
+        self.shaper = shaper or RateShaper()
+        self.entries: dict[str, Entry] = {}
+        self.buckets: dict[int, list[Entry]] = {}
+        self.keys: list[int] = []
+        self.deferred: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.entries
+
+    def get(self, url: str) -> Optional[Entry]:
+        return self.entries.get(url, None)
+
+    def push(self, entry: Entry) -> None:
+        """Add or override URL config, the entry is due at entry.ts."""
+        self.entries[entry.url] = entry
+        self.insert(entry)
+
+    def insert(self, entry: Entry, ts: Optional[float] = None) -> None:
+        """Put entry into the bucket for its due time or the given time if any."""
+        ts = entry.ts if ts is None else ts
+        key = round(ts / constants.TIMELINE_RESOLUTION_SEC)
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            self.buckets[key] = [entry]
+            heapq.heappush(self.keys, key)
+        else:
+            bucket.append(entry)
+
+    def remove(self, url: str) -> Optional[Entry]:
+        self.deferred.discard(url)
+        entry = self.entries.pop(url, None)
+        if entry is not None:
+            self.shaper.release(entry.schedule, entry.slot)
+
+        return entry
+
+    def is_live(self, entry: Entry) -> bool:
+        """
+        Check the entry was not overridden or removed since it was put into the bucket.
+        Overrides are always new objects and an entry is in one bucket at a time.
+        """
+        return self.entries.get(entry.url, None) is entry
+
+    def next_due(self) -> Optional[float]:
+        """Time of the earliest due entry if any."""
+        while self.keys and not any(map(self.is_live, self.buckets[self.keys[0]])):
+            del self.buckets[heapq.heappop(self.keys)]
+
+        return self.keys[0] * constants.TIMELINE_RESOLUTION_SEC if self.keys else None
+
+    def pop_due(self, now: float) -> list[Entry]:
+        """Remove and return every entry due before now, earliest first."""
+        batch: list[Entry] = []
+        live = self.entries.get  # this is the hot loop, hence the inlined is_live()
+        while self.keys and self.keys[0] * constants.TIMELINE_RESOLUTION_SEC < now:
+            bucket = self.buckets.pop(heapq.heappop(self.keys))
+            batch += [x for x in bucket if live(x.url, None) is x]
+
+        return batch
+
+    def reschedule(self, batch: list[Entry]) -> None:
+        """Put popped entries back, each one is due in one more period."""
+        resolution, buckets = constants.TIMELINE_RESOLUTION_SEC, self.buckets
+        for v in batch:
+            v.ts += v.schedule
+            key = round(v.ts / resolution)
+            if key in buckets:
+                buckets[key].append(v)
+            else:
+                buckets[key] = [v]
+                heapq.heappush(self.keys, key)
+
+    def defer(self, batch: list[Entry], until: float) -> int:
+        """Put popped entries back to retry later, their due time stays the same."""
+        for v in batch:
+            self.insert(v, until)
+
+        count = len(self.deferred)
+        self.deferred.update(x.url for x in batch)
+        return len(self.deferred) - count
+
+    def coalesce(self, batch: list[Entry], now: float) -> int:
+        """
+        Entries about to be fired are not deferred anymore, the ones running
+        more than a period late skip the missed periods, we probe once instead.
+        Returns the number of skipped probes.
+        """
+        if self.deferred:
+            self.deferred.difference_update(x.url for x in batch)
+
+        skipped = 0
+        for v in batch:
+            if now - v.ts >= v.schedule > 0:
+                missed = int((now - v.ts) // v.schedule)
+                v.ts += missed * v.schedule
+                skipped += missed
+
+        return skipped
 
 
 def validate_config(config: dict) -> dict:
@@ -75,47 +258,104 @@ def validate_config(config: dict) -> dict:
     return cleaned
 
 
-def reload_config(request: list, config: dict) -> None:
-    """Reload config (but rather append) and start timing requests for overrides from scratch."""
-    new_config = {
-        x["url"]: {**validate_config(x)} for x in request if validate_config(x)
-    }
+def merge_entry(entry: dict, config: Timeline, now: float) -> bool:
+    """
+    Add URL config or override the existing one, return True for new URLs.
+    New URLs go to the least loaded phase slot, overrides keep their timing
+    unless the schedule changes.
+    """
+    existing = config.get(entry["url"])
+    if existing is None or existing.schedule != entry["schedule"]:
+        if existing is not None:
+            config.shaper.release(existing.schedule, existing.slot)
 
-    if new_config:
-        now = util.now()
+        slot = config.shaper.take(entry["schedule"])
+        ts = config.shaper.next_time(entry["schedule"], slot, now)
+        config.push(Entry.from_config(entry, ts, slot))
+    elif existing.regex != (entry.get("regex", None) or None):
+        config.push(Entry.from_config(entry, existing.ts, existing.slot))
 
-        def randomize_time():
-            """generate time offset in fraction of seconds  based on max  connections per sec"""
-            connections_per_second = constants.MAX_POLL_PERIOD_SEC
-            maxrange = len(new_config.keys()) // connections_per_second * 1000
+    return existing is None
 
-            if maxrange > 0:
-                return random.randrange(0, maxrange) / 1000
 
-            return 0
+def reload_config(request: Iterable, config: Timeline) -> list[dict]:
+    """
+    Reload config (but rather append), the URLs we already watch keep their timing.
+    Entries are merged one by one as they come, the request may be a generator.
+    Returns a few new URLs to be probed right away without waiting for their phase,
+    as many as the request rate budget allows in one slot.
+    """
+    now = util.now()
+    allowance = max(1, int(config.shaper.budget * constants.SHAPER_SLOT_SEC))
+    initial: list[dict] = []
+    for x in request:
+        if not (v := validate_config(x)):
+            continue
+
+        if merge_entry(v, config, now) and len(initial) < allowance:
+            initial.append(v)
+
+    # the config might have been overridden later in the same request
+    initial = [config.entries[x["url"]].request(now) for x in initial]
+
+    return initial
 
-        # we want to randomize time as to avoid peaks and spread the load evenly
-        new_config = {
-            k: {**v, "ts": now + randomize_time()} for k, v in new_config.items()
-        }
 
-    config.update(new_config)
+def apply_diff(diff: ConfigDiff, config: Timeline) -> list[dict]:
+    """Apply incremental config update in O(changed), only changed URLs are validated."""
+    for url in diff.remove:
+        config.remove(url)
 
+    return reload_config(diff.upsert, config)
 
-def tick(request: Optional[list], config: dict, sink) -> None:
-    """Check if we are on schedule and issue HTTP requests."""
-    if request:
-        reload_config(request, config)
+
+def available_credit(sink, config: Timeline) -> Optional[int]:
+    """How many requests the next node is ready to take, None if unlimited."""
+    credit = sink.credit()
+    if credit is None and sink.qsize() >= 2 * len(config):
+        # the next node does not do flow control, watch the queue length then
+        return 0
+
+    return credit
+
+
+def tick(request: Optional[ConfigUpdate], config: Timeline, sink) -> None:
+    """
+    Check if we are on schedule and issue HTTP requests.
+    When the next node is out of capacity the due requests are deferred
+    (the oldest go first once there is room) and never dropped.
+    """
+    initial: list[dict] = []
+    if isinstance(request, ConfigDiff):
+        initial = apply_diff(request, config)
+    elif request:
+        initial = reload_config(request, config)
 
     now = util.now()
-    batch = []
-    for k, v in config.items():
-        if now > v["ts"]:
-            v["ts"] += v["schedule"]
-            batch.append(v)
+    batch = config.pop_due(now)
+
+    credit = available_credit(sink, config)
+    if credit is not None and credit < len(batch):
+        batch.sort(key=lambda x: x.ts)
+        batch, held = batch[:credit], batch[credit:]
+        deferred = config.defer(held, now + constants.SCHEDULE_PERIOD)
+        if deferred:
+            registry.increment("scheduler.deferred", deferred)
+            logging.warning(f"Running busy, have to defer {deferred} requests")
 
     if batch:
-        if sink.qsize() < 2 * len(config.keys()):
-            sink.put(batch)
-        else:
-            logging.warning(f"Have to drop a batch of {len(batch)}, running busy")
+        # how late we are compared to the plan, must be close to zero
+        registry.observe("scheduler.firing_lag_ms", (now - batch[0].ts) * 1000)
+
+        coalesced = config.coalesce(batch, now)
+        if coalesced:
+            registry.increment("scheduler.coalesced", coalesced)
+
+    # every request is a new dict, the entries stay with us
+    requests = [x.request() for x in batch]
+    config.reschedule(batch)
+    if credit is None or credit > len(requests):
+        requests += initial[: None if credit is None else credit - len(requests)]
+
+    if requests:
+        sink.put(requests)
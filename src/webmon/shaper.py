@@ -0,0 +1,120 @@
+import heapq
+import logging
+
+from . import constants
+from .metrics import registry
+
+GOLDEN_RATIO = 0.6180339887498949
+
+
+def bit_reverse(value: int, bits: int) -> int:
+    """Reverse the lowest bits of the value, 0b0011 becomes 0b1100 for 4 bits."""
+    return int(format(value, f"0{bits}b")[::-1], 2) if bits else 0
+
+
+class PeriodGroup:
+    """
+    Phase slots of all URLs sharing the same period.
+    A period of P seconds has P / SHAPER_SLOT_SEC slots, every new URL goes
+    into the least loaded one. Empty slots are taken in bit reversed order
+    (0, 1/2, 1/4, 3/4, ...) so that a half filled period is still spread evenly.
+    """
+
+    def __init__(self, period: int):
+        self.size = max(1, round(period / constants.SHAPER_SLOT_SEC))
+        self.bits = (self.size - 1).bit_length()
+        # do not let groups with few URLs pile up on the same slot
+        self.rotation = int(self.size * ((period * GOLDEN_RATIO) % 1))
+        self.counts: dict[int, int] = {}
+        self.level = 0
+        self.index = 0
+        self.freed: list[tuple[int, int, int]] = []
+
+    def next_in_sequence(self) -> int:
+        """Next slot that has not been filled up to the current level yet."""
+        while True:
+            if self.index >= 2**self.bits:
+                self.index = 0
+                self.level += 1
+
+            slot = bit_reverse(self.index, self.bits) * self.size >> self.bits
+            self.index += 1
+            if self.counts.get(slot, 0) <= self.level:
+                return slot
+
+    def take(self) -> int:
+        """Occupy the least loaded slot."""
+        while self.freed and self.counts.get(self.freed[0][2], 0) != self.freed[0][0]:
+            heapq.heappop(self.freed)
+
+        if self.freed and self.freed[0][0] <= self.level:
+            slot = heapq.heappop(self.freed)[2]
+        else:
+            slot = self.next_in_sequence()
+
+        self.counts[slot] = self.counts.get(slot, 0) + 1
+        return slot
+
+    def release(self, slot: int) -> None:
+        self.counts[slot] -= 1
+        heapq.heappush(
+            self.freed, (self.counts[slot], bit_reverse(slot, self.bits), slot)
+        )
+
+    def phase(self, slot: int) -> float:
+        """Offset of the slot from the beginning of the period in seconds."""
+        return ((slot + self.rotation) % self.size) * constants.SHAPER_SLOT_SEC
+
+
+class RateShaper:
+    """
+    Assigns every URL a phase within its period to keep the outgoing request rate flat.
+    Phases are counted from the epoch, so the same URL gets the same timing
+    no matter when the config was loaded. The slots are kept by the caller
+    along with the rest of the URL config, there is no per URL state here.
+    """
+
+    def __init__(self, budget: float = constants.MAX_REQUESTS_PER_SEC):
+        self.budget = budget
+        self.rate = 0.0
+        self.groups: dict[int, PeriodGroup] = {}
+
+    def take(self, period: int) -> int:
+        """Occupy the least loaded slot of the period."""
+        if period <= 0:
+            return -1
+
+        if period not in self.groups:
+            self.groups[period] = PeriodGroup(period)
+
+        self.rate += 1 / period
+        self.report()
+        return self.groups[period].take()
+
+    def release(self, period: int, slot: int) -> None:
+        """Free the slot taken before."""
+        if period > 0 and slot >= 0:
+            self.groups[period].release(slot)
+            self.rate -= 1 / period
+            self.report()
+
+    def phase(self, period: int, slot: int) -> float:
+        """Offset of the slot from the beginning of the period in seconds."""
+        return self.groups[period].phase(slot) if period > 0 and slot >= 0 else 0.0
+
+    def next_time(self, period: int, slot: int, now: float) -> float:
+        """First time in the future the slot is due."""
+        if period <= 0:
+            return now
+
+        return now + (self.phase(period, slot) - now) % period
+
+    def report(self) -> None:
+        overbooked = self.rate > self.budget
+        if overbooked and not registry.get("scheduler.overbooked"):
+            logging.warning(
+                f"Configured {self.rate:.0f} requests/sec, the budget is {self.budget:.0f}"
+            )
+
+        registry.set("scheduler.requests_per_sec", self.rate)
+        registry.set("scheduler.overbooked", int(overbooked))
@@ -0,0 +1,130 @@
+import bisect
+import hashlib
+import multiprocessing
+
+from threading import Thread
+from typing import Any
+
+from . import constants
+from .pipeline import Pipeline
+from .scheduler import schedule, ConfigDiff
+from .monitor import monitor, MonitorOptions
+
+
+def hash64(key: str) -> int:
+    """Stable (unlike the builtin hash) 64 bit hash of the string."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring, maps URLs to shards.
+    Every shard has a number of virtual nodes on the ring, so that adding a shard
+    takes over about 1/N of the URLs from every other shard and leaves the rest alone.
+    """
+
+    def __init__(self, shards: int, replicas: int = constants.HASH_RING_REPLICAS):
+        points = sorted(
+            (hash64(f"{shard}:{i}"), shard)
+            for shard in range(0, shards)
+            for i in range(0, replicas)
+        )
+        self.hashes = [x[0] for x in points]
+        self.shards = [x[1] for x in points]
+
+    def __call__(self, key: str) -> int:
+        """Shard that owns the key."""
+        i = bisect.bisect(self.hashes, hash64(key)) % len(self.hashes)
+        return self.shards[i]
+
+
+def split_config(message: Any, ring: HashRing, count: int) -> list[Any]:
+    """Split config message into per shard messages, None if the shard has nothing to do."""
+
+    def partition(items, key) -> list[list]:
+        parts: list[list] = [[] for _ in range(0, count)]
+        for x in items:
+            parts[ring(key(x))].append(x)
+        return parts
+
+    def url(x) -> str:
+        return str(x.get("url", "")) if isinstance(x, dict) else ""
+
+    if isinstance(message, ConfigDiff):
+        upsert = partition(message.upsert, url)
+        remove = partition(message.remove, str)
+        return [ConfigDiff(*x) if x[0] or x[1] else None for x in zip(upsert, remove)]
+
+    return [x or None for x in partition(message, url)]
+
+
+def run_shard(inbox, outbox, options: MonitorOptions = MonitorOptions()) -> None:
+    """Shard process: runs its own scheduler and monitor, sends results to the outbox."""
+
+    def monitor_with_options(source, sink) -> None:
+        monitor(source, sink, options)
+
+    def forward(source, sink) -> None:
+        while batch := source.get():
+            outbox.put(batch)
+
+    pipeline = Pipeline.build(schedule, monitor_with_options, forward)
+    while message := inbox.get():
+        pipeline.put(message)
+
+    pipeline.put(None).wait()
+    outbox.put(None)
+
+
+class Shards:
+    """
+    Pipeline handler that takes the place of the scheduler and the monitor.
+    Partitions URLs across a number of worker processes with consistent hashing,
+    each process runs its own scheduler and monitor, results from all of them
+    are gathered into the sink for the rest of the pipeline.
+    """
+
+    def __init__(self, count: int, options: MonitorOptions = MonitorOptions()):
+        self.count = count
+        self.ring = HashRing(count)
+        self.options = options
+
+    def __call__(self, source, sink) -> None:
+        # fork does not play well with the threads we have running
+        context = multiprocessing.get_context("spawn")
+        outbox = context.Queue()
+        inboxes = [context.Queue() for _ in range(0, self.count)]
+        processes = [
+            context.Process(
+                target=run_shard, args=[x, outbox, self.options], daemon=True
+            )
+            for x in inboxes
+        ]
+        for process in processes:
+            process.start()
+
+        def gather() -> None:
+            finished = 0
+            while finished < self.count:
+                batch = outbox.get()
+                if batch:
+                    sink.put(batch)
+                else:
+                    finished += 1
+
+        relay = Thread(target=gather)
+        relay.start()
+
+        while message := source.get():
+            if isinstance(message, (list, ConfigDiff)):
+                parts = split_config(message, self.ring, self.count)
+                for inbox, part in zip(inboxes, parts):
+                    if part:
+                        inbox.put(part)
+
+        for inbox in inboxes:
+            inbox.put(None)
+
+        relay.join()
+        for process in processes:
+            process.join()
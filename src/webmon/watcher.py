@@ -0,0 +1,159 @@
+import ctypes
+import logging
+import os
+import select
+import struct
+import sys
+
+from threading import Thread
+from typing import Callable, Iterable, Optional
+
+from . import constants
+from .scheduler import ConfigDiff, validate_config
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def index_config(config: Iterable[dict]) -> dict[str, tuple]:
+    """Schedule and regex of valid URL configs by URL, tuples take less memory than dicts."""
+    index = {}
+    for x in config:
+        if cleaned := validate_config(x):
+            url = sys.intern(cleaned["url"])
+            index[url] = (cleaned["schedule"], cleaned.get("regex", None))
+
+    return index
+
+
+def diff_config(old: dict[str, tuple], new: dict[str, tuple]) -> ConfigDiff:
+    """Minimal update turning the old config into the new one."""
+    upsert = []
+    for url, (schedule, regex) in new.items():
+        if old.get(url, None) != (schedule, regex):
+            upsert.append({"url": url, "schedule": schedule})
+            if regex:
+                upsert[-1]["regex"] = regex
+
+    return ConfigDiff(upsert=upsert, remove=[k for k in old.keys() if not k in new])
+
+
+def inotify_watch(directory: str) -> Optional[int]:
+    """Start watching the directory for new and changed files, None if there is no inotify."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+
+    if fd < 0:
+        return None
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def read_inotify_names(fd: int) -> list[str]:
+    """Names of the files from the pending inotify events."""
+    names = []
+    try:
+        while data := os.read(fd, 64 * 1024):
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                names.append(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+                offset += length
+    except BlockingIOError:
+        pass
+
+    return names
+
+
+class ConfigWatcher:
+    """
+    Watches the config file and sends the changes to the pipeline.
+    Uses inotify where available and polls the file modification time otherwise,
+    trigger() forces the reload (this is what SIGHUP does).
+    Only the difference between the old and the new config is sent,
+    so reloading does not restart anything and URLs keep their timing.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        load: Callable[[str], Optional[list[dict]]],
+        put: Callable,
+        config: list[dict],
+        use_inotify: bool = True,
+    ):
+        self.path = os.path.abspath(path)
+        self.load = load
+        self.put = put
+        self.config = index_config(config)
+        self.fd = inotify_watch(os.path.dirname(self.path)) if use_inotify else None
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.mtime = self.modification_time()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self) -> "ConfigWatcher":
+        self.thread.start()
+        return self
+
+    def trigger(self) -> None:
+        """Reload the config now, safe to call from the signal handler."""
+        os.write(self.wakeup_write, b"\0")
+
+    def modification_time(self) -> float:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return 0
+
+    def wait_for_change(self) -> None:
+        """Block until the file changes or somebody pulls the trigger."""
+        while True:
+            fds = [self.wakeup_read] + ([self.fd] if self.fd is not None else [])
+            timeout = None if self.fd is not None else constants.CONFIG_POLL_SEC
+            ready, _, _ = select.select(fds, [], [], timeout)
+
+            if self.wakeup_read in ready:
+                os.read(self.wakeup_read, 1024)
+                return
+
+            if self.fd is not None and self.fd in ready:
+                names = read_inotify_names(self.fd)
+                if os.path.basename(self.path) in names:
+                    return
+
+            if self.fd is None and self.modification_time() != self.mtime:
+                return
+
+    def reload(self) -> None:
+        """Load the file and send the difference."""
+        self.mtime = self.modification_time()
+        config = self.load(self.path)
+        if not config:
+            logging.error(f"Unable to reload config from {self.path}, keep the old one")
+            return
+
+        new = index_config(config)
+        diff = diff_config(self.config, new)
+        self.config = new
+        if diff.upsert or diff.remove:
+            logging.info(
+                f"Config reloaded: {len(diff.upsert)} updated, {len(diff.remove)} removed"
+            )
+            self.put(diff)
+
+    def run(self) -> None:
+        while True:
+            self.wait_for_change()
+            self.reload()
@@ -0,0 +1,89 @@
+import time
+import tempfile
+
+from webmon.cluster import Cluster, SqliteLeases, numbered_placeholders
+from webmon.pipeline import Pipeline
+from webmon.scheduler import ConfigDiff
+
+from tests.pipeline_nodes import Store
+
+
+def make_store(path: str, partitions: int = 8) -> SqliteLeases:
+    store = SqliteLeases(path)
+    store.setup(partitions)
+    return store
+
+
+def test_single_node_owns_everything():
+    with tempfile.NamedTemporaryFile() as tmp:
+        store = make_store(tmp.name)
+        assert set(range(0, 8)) == store.acquire("a", 100, 10)
+
+
+def test_share_with_new_node():
+    with tempfile.NamedTemporaryFile() as tmp:
+        a, b = make_store(tmp.name), make_store(tmp.name)
+        a.acquire("a", 100, 10)
+
+        assert not b.acquire("b", 101, 10)
+        assert 4 == len(a.acquire("a", 102, 10))
+        assert 4 == len(b.acquire("b", 103, 10))
+        assert not a.acquire("a", 104, 10) & b.acquire("b", 104, 10)
+
+
+def test_take_over_dead_node():
+    with tempfile.NamedTemporaryFile() as tmp:
+        a, b = make_store(tmp.name), make_store(tmp.name)
+        a.acquire("a", 100, 10)
+        b.acquire("b", 101, 10)
+        a.acquire("a", 102, 10)
+        b.acquire("b", 103, 10)
+
+        # a is gone, its leases expire at 112
+        assert 4 == len(b.acquire("b", 110, 10))
+        assert 8 == len(b.acquire("b", 113, 10))
+
+
+def test_release_on_shutdown():
+    with tempfile.NamedTemporaryFile() as tmp:
+        a, b = make_store(tmp.name), make_store(tmp.name)
+        a.acquire("a", 100, 10)
+        a.release("a")
+
+        assert 8 == len(b.acquire("b", 101, 10))
+
+
+def test_numbered_placeholders():
+    assert "SELECT $1, $2" == numbered_placeholders("SELECT ?, ?")
+
+
+def test_forward_owned_urls():
+    with tempfile.NamedTemporaryFile() as tmp:
+        store = Store()
+        pl = Pipeline.build(Cluster(SqliteLeases(tmp.name), "a"), store)
+
+        urls = [f"http://acme.com/{i}" for i in range(0, 10)]
+        pl.put([{"url": x, "schedule": 1} for x in urls])
+        pl.put(ConfigDiff(remove=urls[:2]), None).wait()
+
+        assert urls == [x["url"] for x in store.data[0]]
+        assert urls[:2] == list(store.data[1].remove)
+
+
+def test_follow_ownership_changes():
+    with tempfile.NamedTemporaryFile() as tmp:
+        cluster = Cluster(make_store(tmp.name, 4), "a", partitions=4, ttl=10)
+        other = make_store(tmp.name, 4)
+
+        urls = [f"http://acme.com/{i}" for i in range(0, 100)]
+        assert not cluster.accept([{"url": x, "schedule": 1} for x in urls])
+        assert 100 == len(cluster.renew().upsert)
+
+        other.acquire("b", time.time(), 10)
+        lost = cluster.renew().remove
+        other.acquire("b", time.time(), 10)
+
+        assert 0 < len(lost) < 100
+        assert 100 - len(lost) == len(
+            cluster.accept([{"url": x, "schedule": 1} for x in urls])
+        )
@@ -0,0 +1,56 @@
+import io
+import json
+import logging
+
+from webmon import constants
+from webmon.loader import iter_config, iter_json_array, load_config
+
+logger = logging.getLogger()
+logger.disabled = True
+
+config = [
+    {"url": "http://acme.com/1", "schedule": 1},
+    {"url": "http://acme.com/2", "schedule": 5, "regex": "fo[o]"},
+    {"url": "http://acme.com/3", "schedule": 100},
+]
+
+
+def test_json_array_across_chunks(monkeypatch):
+    monkeypatch.setattr(constants, "CONFIG_CHUNK_SIZE", 7)
+    values = [1, 12345, "text", {"a": [1, 2, {"b": None}]}, [], 3.5]
+
+    assert values == list(iter_json_array(io.StringIO(json.dumps(values))))
+    assert values == list(iter_json_array(io.StringIO(json.dumps(values, indent=4))))
+    assert [] == list(iter_json_array(io.StringIO(" [ ] ")))
+
+
+def test_broken_json_array(monkeypatch):
+    monkeypatch.setattr(constants, "CONFIG_CHUNK_SIZE", 7)
+    for text in ["[1, 2", "[1 2]", "[1,, 2]", '{"a": 1}', '[{"a": 1]']:
+        try:
+            list(iter_json_array(io.StringIO(text)))
+            assert False, text
+        except ValueError:
+            pass
+
+
+def test_config_from_json_array():
+    text = json.dumps(config + [{"url": "http://acme.com/4"}, 5])
+    assert config == list(iter_config(io.StringIO("\n  " + text)))
+
+
+def test_config_from_json_lines():
+    lines = [json.dumps(x) for x in config] + ["", "{broken", '{"schedule": 1}']
+    assert config == list(iter_config(io.StringIO("\n".join(lines))))
+
+
+def test_load_config(tmp_path):
+    path = tmp_path / "config.jsonl"
+    path.write_text("\n".join(json.dumps(x) for x in config))
+
+    assert config == load_config(str(path))
+    assert config == load_config(json.dumps(config))
+    assert None == load_config(str(tmp_path / "missing.json"))
+
+    path.write_text(json.dumps(config)[:-1])
+    assert None == load_config(str(path))
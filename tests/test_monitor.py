@@ -4,15 +4,22 @@ import asyncio
 import json
 
 from webmon.pipeline import Pipeline
-from webmon.monitor import monitor
+from webmon.monitor import monitor, MonitorOptions
+from webmon.metrics import registry
+import webmon.constants as constants
 
 from tests.server import start
 from tests.pipeline_nodes import Store
 
 
-def make_pipeline() -> tuple[Pipeline, list[dict]]:
+def make_pipeline(
+    options: MonitorOptions = MonitorOptions(),
+) -> tuple[Pipeline, list[dict]]:
+    def monitor_with_options(source, sink) -> None:
+        monitor(source, sink, options)
+
     store = Store()
-    return (Pipeline.build(monitor, store), store.data)
+    return (Pipeline.build(monitor_with_options, store), store.data)
 
 
 def make_batch(server, count=1, path="http200", schedule=1) -> list[dict]:
@@ -58,7 +65,8 @@ async def test_no_early_termination(aiohttp_server):
 
 
 @pytest.mark.asyncio
-async def test_time_successful_concurrent_request(aiohttp_server):
+async def test_time_successful_concurrent_request(aiohttp_server, monkeypatch):
+    monkeypatch.setattr(constants, "MAX_CONNECTIONS_PER_HOST", 100)
     server = await start(aiohttp_server)
     pl, output = make_pipeline()
 
@@ -73,7 +81,8 @@ async def test_time_successful_concurrent_request(aiohttp_server):
 
 
 @pytest.mark.asyncio
-async def test_timed_out_concurrent_request(aiohttp_server):
+async def test_timed_out_concurrent_request(aiohttp_server, monkeypatch):
+    monkeypatch.setattr(constants, "MAX_CONNECTIONS_PER_HOST", 100)
     server = await start(aiohttp_server)
     pl, output = make_pipeline()
 
@@ -98,6 +107,82 @@ async def test_measure_time(aiohttp_server):
     assert reponse_time > 170 and reponse_time < 200
 
 
+@pytest.mark.asyncio
+async def test_limit_concurrent_requests_per_host(aiohttp_server, monkeypatch):
+    monkeypatch.setattr(constants, "MAX_CONNECTIONS_PER_HOST", 1)
+    server = await start(aiohttp_server)
+    pl, output = make_pipeline()
+
+    slow = make_batch(server, 3, "sleep?ms=300", 5)
+    other = [
+        {"url": str(slow[0]["url"]).replace("localhost", "127.0.0.1"), "schedule": 5}
+    ]
+    await pl.put(slow + other, None).wait_async()
+
+    results = sorted([y for x in output for y in x], key=lambda x: x["ts"])
+    starts = [x["ts"] for x in results if "localhost" in str(x["url"])]
+    assert all(b - a >= 0.3 for a, b in zip(starts, starts[1:]))
+    assert "127.0.0.1" in str(results[1]["url"])
+
+
+@pytest.mark.asyncio
+async def test_space_requests_to_same_host(aiohttp_server, monkeypatch):
+    monkeypatch.setattr(constants, "MIN_HOST_SPACING_SEC", 0.1)
+    server = await start(aiohttp_server)
+    pl, output = make_pipeline()
+
+    await pl.put(make_batch(server, 5), None).wait_async()
+
+    starts = sorted([y["ts"] for x in output for y in x])
+    assert 5 == len(starts)
+    assert all(b - a >= 0.09 for a, b in zip(starts, starts[1:]))
+
+
+@pytest.mark.asyncio
+async def test_new_connection_per_request(aiohttp_server):
+    registry.reset()
+    server = await start(aiohttp_server)
+    pl, output = make_pipeline()
+
+    req = make_batch(server, 1)
+    await pl.put(req, req, req, None).wait_async()
+
+    assert 3 == registry.get("monitor.connections_created")
+    assert 0 == registry.get("monitor.connections_reused")
+    assert 3 == registry.snapshot()["monitor.connect_ms.count"]
+
+
+@pytest.mark.asyncio
+async def test_keep_alive(aiohttp_server):
+    registry.reset()
+    server = await start(aiohttp_server)
+    pl, output = make_pipeline(MonitorOptions(keep_alive=True))
+
+    for _ in range(0, 5):
+        pl.put(make_batch(server, 1))
+        # one at a time, otherwise there are concurrent connections
+        await asyncio.sleep(0.5)
+    await pl.put(None).wait_async()
+
+    assert [200] * 5 == [y["code"] for x in output for y in x]
+    assert 1 == registry.get("monitor.connections_created")
+    assert 4 == registry.get("monitor.connections_reused")
+    assert 1 == registry.snapshot()["monitor.connect_ms.count"]
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_timeout_per_request(aiohttp_server):
+    server = await start(aiohttp_server)
+    pl, output = make_pipeline(MonitorOptions(keep_alive=True))
+
+    slow = make_batch(server, 1, "sleep?ms=1500", 1)
+    fast = make_batch(server, 1, "sleep?ms=1500", 5)
+    await pl.put(slow + fast, None).wait_async()
+
+    statuses = {y["schedule"]: y["status"] for x in output for y in x}
+    assert {1: "TimeoutError", 5: "completed"} == statuses
+
+
 @pytest.mark.skip(reason="need a real thing for this test")
 def test_thousands_connections():
     pl, output = make_pipeline()
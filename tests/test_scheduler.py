@@ -1,11 +1,21 @@
 import time
 import logging
 
-from webmon.pipeline import Pipeline
-from webmon.scheduler import schedule
+from webmon.pipeline import Pipeline, Channel
+from webmon.scheduler import (
+    schedule,
+    tick,
+    Timeline,
+    Entry,
+    ConfigDiff,
+    apply_diff,
+    reload_config,
+)
 from webmon.monitor import monitor
 
 import webmon.constants as constants
+import webmon.util as util
+from webmon.metrics import registry
 from tests.pipeline_nodes import Store, Sleep
 
 # i'll have a bunch of warnings in my tests i do not want them to spoil my console output
@@ -26,6 +36,38 @@ def test_schedule():
     assert 1 <= len(store.data) and len(store.data) <= 2
 
 
+def test_fire_on_time():
+    registry.reset()
+    store = Store()
+    pl = Pipeline.build(schedule, store)
+
+    pl.put([{"url": "http://acme.com", "schedule": 1}])
+    time.sleep(1.1)
+    pl.put(None).wait()
+
+    # the first one is not on schedule, fired right after loading config
+    metrics = registry.snapshot()
+    assert 1 <= metrics["scheduler.firing_lag_ms.count"]
+    assert len(store.data) == metrics["scheduler.firing_lag_ms.count"] + 1
+    assert metrics["scheduler.firing_lag_ms.max"] < 5
+
+
+def test_wake_up_on_new_config():
+    store = Store()
+    pl = Pipeline.build(schedule, store)
+
+    pl.put([{"url": "http://acme.com", "schedule": 300}])
+    time.sleep(0.05)
+
+    started = time.time()
+    pl.put([{"url": "http://foo.com", "schedule": 300}])
+    while len(store.data) < 2 and time.time() - started < 1:
+        time.sleep(0.001)
+
+    assert time.time() - started < 0.05
+    pl.put(None).wait()
+
+
 def test_uber_fast_schedule():
     # sorry, just could not stand long running tests
     constants.MIN_POLL_PERIOD_SEC = 0
@@ -53,3 +95,113 @@ def test_drop_because_pipeline_is_busy():
 
     pl.put(None).wait()
     assert len(store.data) < 10
+
+
+def test_timeline_pops_in_order():
+    timeline = Timeline()
+    for ts in [3, 1, 2]:
+        timeline.push(Entry(f"http://acme.com/{ts}", 1, None, ts))
+
+    assert 1 == timeline.next_due()
+    assert [] == timeline.pop_due(1)
+    assert [1, 2] == [x.ts for x in timeline.pop_due(2.5)]
+    assert 3 == timeline.next_due()
+    assert 3 == len(timeline)
+
+
+def test_timeline_skips_overridden_and_removed():
+    timeline = Timeline()
+    timeline.push(Entry("http://acme.com", 1, None, 1))
+    timeline.push(Entry("http://acme.com", 1, None, 5))
+    timeline.push(Entry("http://foo.com", 1, None, 2))
+    timeline.remove("http://foo.com")
+
+    assert 5 == timeline.next_due()
+    assert [] == timeline.pop_due(4)
+    assert ["http://acme.com"] == [x.url for x in timeline.pop_due(6)]
+    assert None == timeline.next_due()
+
+
+def test_config_diff():
+    timeline = Timeline()
+    reload_config(
+        [
+            {"url": "http://acme.com", "schedule": 10},
+            {"url": "http://foo.com", "schedule": 10},
+            {"url": "http://bar.com", "schedule": 10},
+        ],
+        timeline,
+    )
+    later = util.now() + 1000
+    for v in list(timeline.entries.values()):
+        timeline.push(Entry(v.url, v.schedule, v.regex, later))
+
+    apply_diff(
+        ConfigDiff(
+            upsert=[
+                {"url": "http://foo.com", "schedule": 5},
+                {"url": "http://bar.com", "schedule": 10, "regex": "bar"},
+                {"url": "http://new.com", "schedule": 10},
+            ],
+            remove=["http://acme.com", "http://unknown.com"],
+        ),
+        timeline,
+    )
+
+    assert ["http://bar.com", "http://foo.com", "http://new.com"] == sorted(
+        timeline.entries.keys()
+    )
+    assert later > timeline.get("http://foo.com").ts
+    assert later == timeline.get("http://bar.com").ts
+    assert "bar" == timeline.get("http://bar.com").regex
+    assert later > timeline.get("http://new.com").ts
+
+
+def test_remove_url_from_schedule():
+    timeline = Timeline()
+    reload_config([{"url": "http://acme.com", "schedule": 1}], timeline)
+    apply_diff(ConfigDiff(remove=["http://acme.com"]), timeline)
+
+    assert 0 == len(timeline)
+    assert None == timeline.next_due()
+    assert 0 == timeline.shaper.rate
+
+
+def test_defer_when_out_of_credit():
+    registry.reset()
+    timeline = Timeline()
+    sink = Channel()
+    sink.grant(3)
+
+    now = util.now()
+    for i in range(0, 10):
+        timeline.push(Entry(f"http://acme.com/{i}", 10, None, now - i - 1))
+
+    tick(None, timeline, sink)
+    assert 0 == sink.credit()
+    assert ["http://acme.com/9", "http://acme.com/8", "http://acme.com/7"] == [
+        x["url"] for x in sink.get()
+    ]
+    assert 7 == registry.get("scheduler.deferred")
+
+    # nothing is lost, the rest goes as soon as there is credit
+    time.sleep(constants.SCHEDULE_PERIOD)
+    sink.grant(100)
+    tick(None, timeline, sink)
+    assert 7 == len(sink.get())
+    assert 7 == registry.get("scheduler.deferred")
+    assert not timeline.deferred
+
+
+def test_coalesce_missed_periods():
+    registry.reset()
+    timeline = Timeline()
+    sink = Channel()
+
+    now = util.now()
+    timeline.push(Entry("http://acme.com", 1, None, now - 2.5))
+    tick(None, timeline, sink)
+
+    assert 1 == len(sink.get())
+    assert 2 == registry.get("scheduler.coalesced")
+    assert now < timeline.get("http://acme.com").ts < now + 1
@@ -0,0 +1,54 @@
+from webmon.shaper import RateShaper
+import webmon.constants as constants
+
+
+def count_per_slot(
+    shaper: RateShaper, slots: list[tuple[int, int]], seconds: int
+) -> list[int]:
+    slots_per_sec = round(1 / constants.SHAPER_SLOT_SEC)
+    counts = [0] * (seconds * slots_per_sec)
+    for period, slot in slots:
+        ts = shaper.next_time(period, slot, 0)
+        while ts < seconds:
+            counts[round(ts / constants.SHAPER_SLOT_SEC)] += 1
+            ts += period
+
+    return counts
+
+
+def test_flat_rate():
+    shaper = RateShaper()
+    periods = [[1, 5, 7][i % 3] for i in range(0, 10000)]
+    slots = [(x, shaper.take(x)) for x in periods]
+
+    counts = count_per_slot(shaper, slots, 35)
+    average = sum(counts) / len(counts)
+    assert max(counts) <= average + 2
+    assert min(counts) >= average - 2
+
+
+def test_half_filled_period_is_spread():
+    shaper = RateShaper()
+    phases = sorted(shaper.phase(1, shaper.take(1)) for i in range(0, 4))
+
+    gaps = [b - a for a, b in zip(phases, phases[1:] + [phases[0] + 1])]
+    assert all(abs(x - 0.25) < 0.02 for x in gaps)
+
+
+def test_reuse_released_slot():
+    shaper = RateShaper()
+    slots = [shaper.take(1) for i in range(0, 100)]
+
+    shaper.release(1, slots[50])
+    assert slots[50] == shaper.take(1)
+    assert 100 == round(shaper.rate)
+
+
+def test_rate_follows_periods():
+    shaper = RateShaper()
+    slot = shaper.take(5)
+    assert 0.2 == round(shaper.rate, 3)
+
+    shaper.release(5, slot)
+    shaper.take(10)
+    assert 0.1 == round(shaper.rate, 3)
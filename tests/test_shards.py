@@ -0,0 +1,54 @@
+import pytest
+
+from webmon.pipeline import Pipeline
+from webmon.scheduler import ConfigDiff
+from webmon.shards import HashRing, Shards, split_config
+
+from tests.server import start
+from tests.pipeline_nodes import Store
+
+
+def test_spread_evenly():
+    ring = HashRing(4)
+    shards = [ring(f"http://acme.com/{i}") for i in range(0, 10000)]
+
+    assert all(1900 < shards.count(x) < 3100 for x in range(0, 4))
+
+
+def test_adding_shard_remaps_few():
+    before = HashRing(4)
+    after = HashRing(5)
+    urls = [f"http://acme.com/{i}" for i in range(0, 10000)]
+
+    moved = [x for x in urls if before(x) != after(x)]
+    assert 1500 < len(moved) < 2500
+    assert all(4 == after(x) for x in moved)
+
+
+def test_split_config():
+    ring = HashRing(2)
+    urls = [f"http://acme.com/{i}" for i in range(0, 10)]
+
+    parts = split_config([{"url": x, "schedule": 1} for x in urls], ring, 2)
+    assert 10 == sum(len(x) for x in parts)
+    assert all(ring(y["url"]) == i for i, x in enumerate(parts) for y in x)
+
+    parts = split_config(ConfigDiff(remove=urls[:1]), ring, 2)
+    assert [ConfigDiff([], urls[:1])] == [x for x in parts if x]
+
+
+@pytest.mark.asyncio
+async def test_sharded_pipeline(aiohttp_server):
+    server = await start(aiohttp_server)
+    store = Store()
+    pl = Pipeline.build(Shards(2), store)
+
+    req = [
+        {"url": str(server.make_url(f"http200?n={i}")), "schedule": 1}
+        for i in range(0, 10)
+    ]
+    await pl.put(req, None).wait_async()
+
+    data = [x for batch in store.data for x in batch]
+    assert sorted(x["url"] for x in req) == sorted(x["url"] for x in data)
+    assert [200] * len(data) == [x["code"] for x in data]
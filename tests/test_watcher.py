@@ -0,0 +1,90 @@
+import json
+import queue
+
+from webmon import constants
+from webmon.loader import load_config
+from webmon.scheduler import ConfigDiff
+from webmon.watcher import ConfigWatcher, diff_config, index_config
+
+config = [
+    {"url": "http://acme.com/1", "schedule": 1},
+    {"url": "http://acme.com/2", "schedule": 5},
+    {"url": "http://acme.com/3", "schedule": 5, "regex": "foo"},
+]
+
+
+def write_config(path, config) -> None:
+    with open(path, "w") as f:
+        f.write(json.dumps(config))
+
+
+def test_diff_config():
+    new = [
+        {"url": "http://acme.com/1", "schedule": 1},
+        {"url": "http://acme.com/2", "schedule": 10},
+        {"url": "http://acme.com/4", "schedule": 5},
+        {"url": "bad url"},
+    ]
+
+    diff = diff_config(index_config(config), index_config(new))
+    assert ["http://acme.com/2", "http://acme.com/4"] == [x["url"] for x in diff.upsert]
+    assert ["http://acme.com/3"] == list(diff.remove)
+
+
+def test_nothing_changed():
+    diff = diff_config(index_config(config), index_config(list(reversed(config))))
+    assert not diff.upsert and not diff.remove
+
+
+def test_reload_on_file_change(tmp_path):
+    path = tmp_path / "config.json"
+    write_config(path, config)
+    updates: queue.SimpleQueue = queue.SimpleQueue()
+    ConfigWatcher(str(path), load_config, updates.put, config).start()
+
+    write_config(path, config[:2])
+    diff = updates.get(timeout=5)
+    assert ConfigDiff([], ["http://acme.com/3"]) == diff
+
+
+def test_reload_with_polling(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "CONFIG_POLL_SEC", 0.01)
+    path = tmp_path / "config.json"
+    write_config(path, config)
+    updates: queue.SimpleQueue = queue.SimpleQueue()
+    ConfigWatcher(
+        str(path), load_config, updates.put, config, use_inotify=False
+    ).start()
+
+    write_config(path, config + [{"url": "http://acme.com/4", "schedule": 1}])
+    diff = updates.get(timeout=5)
+    assert ["http://acme.com/4"] == [x["url"] for x in diff.upsert]
+
+
+def test_reload_on_trigger(tmp_path):
+    path = tmp_path / "config.json"
+    write_config(path, config)
+    updates: queue.SimpleQueue = queue.SimpleQueue()
+    watcher = ConfigWatcher(str(path), load_config, updates.put, [])
+    watcher.start()
+
+    watcher.trigger()
+    diff = updates.get(timeout=5)
+    assert 3 == len(diff.upsert)
+
+
+def test_keep_config_when_broken(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "CONFIG_POLL_SEC", 0.01)
+    path = tmp_path / "config.json"
+    write_config(path, config)
+    updates: queue.SimpleQueue = queue.SimpleQueue()
+    watcher = ConfigWatcher(str(path), load_config, updates.put, config)
+    watcher.start()
+
+    with open(path, "w") as f:
+        f.write("[{broken")
+    watcher.trigger()
+
+    write_config(path, config[1:])
+    diff = updates.get(timeout=5)
+    assert ConfigDiff([], ["http://acme.com/1"]) == diff